@@ -1,45 +1,158 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-from flask_session import Session
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response, g
 from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
-import anthropic
+from contextlib import contextmanager
 import os
 import uuid
 import time
-from docx import Document
 import io
 import re
+import gzip
+import hashlib
 import threading
+import fcntl
 import json
 from dotenv import load_dotenv
-import docx2txt
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+import job_queue
+import profiling
+from sessions import ReadOnlyFileSystemSessionInterface, SqliteSessionInterface, session_readonly
+from assets import AssetPipeline
 
 # Load environment variables from .env file if it exists
 load_dotenv()
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "plotpointe_secret_key")
-app.config["SESSION_TYPE"] = "filesystem"
 app.config["SESSION_PERMANENT"] = True
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=7)
-Session(app)
+
+# Session backend: "sqlite" (default; in-memory cache + SQLite, with background expiry)
+# or "filesystem" (flask_session). Both skip saving the session on @session_readonly views.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+if SESSION_BACKEND == "sqlite":
+    app.session_interface = SqliteSessionInterface(
+        os.getenv("SESSION_DB_PATH", "plotpointe_sessions.db"),
+        permanent=app.config["SESSION_PERMANENT"]
+    )
+else:
+    app.config["SESSION_TYPE"] = "filesystem"
+    app.config.setdefault("SESSION_FILE_DIR", os.path.join(os.getcwd(), "flask_session"))
+    # Old session files are only pruned once this many files exist
+    app.config.setdefault("SESSION_FILE_THRESHOLD", 500)
+    app.config.setdefault("SESSION_FILE_MODE", 384)
+    app.config.setdefault("SESSION_KEY_PREFIX", "session:")
+    app.config.setdefault("SESSION_USE_SIGNER", False)
+    # Same interface flask_session's Session(app) builds, but honouring @session_readonly
+    app.session_interface = ReadOnlyFileSystemSessionInterface(
+        app.config["SESSION_FILE_DIR"],
+        app.config["SESSION_FILE_THRESHOLD"],
+        app.config["SESSION_FILE_MODE"],
+        app.config["SESSION_KEY_PREFIX"],
+        app.config["SESSION_USE_SIGNER"],
+        app.config["SESSION_PERMANENT"]
+    )
+
+# Fingerprinted, precompressed static assets (templates use asset_url)
+AssetPipeline(app)
 
 # Get API key from environment
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-# Simple user database - in production, use a real database
-USERS = {
+# Where generation runs: "thread" (default) runs pipelines inside the web process,
+# "queue" only enqueues jobs for the separate worker process (python -m worker).
+# Queue mode keeps jobs in a local SQLite file, so the web and worker processes must
+# run on the same host (or share a volume) - it does not work across Heroku dynos.
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "thread")
+
+# Two-phase plot generation settings
+PLOT_TWO_PHASE_THRESHOLD = int(os.getenv("PLOT_TWO_PHASE_THRESHOLD", 40))  # paragraphs x progressions
+PLOT_EXPANSION_WORKERS = int(os.getenv("PLOT_EXPANSION_WORKERS", 4))
+PLOT_EXPANSION_RETRIES = int(os.getenv("PLOT_EXPANSION_RETRIES", 2))
+PLOT_SKELETON_LINE = re.compile(r'^\**\s*Paragraph\s+(\d+)\s*\**\s*\|\s*(.+?)\s*\|\s*(.+)$', re.IGNORECASE)
+PLOT_PROGRESSION_LINE = re.compile(r'^\s*\**\d+\.\s+\**\(Progression #\d+\)', re.MULTILINE)
+
+# Simple user database - in production, use a real database.
+# Users are persisted to USERS_FILE and loaded on first use; these defaults (with
+# precomputed hashes, so importing the app doesn't run PBKDF2) seed a missing file.
+USERS_FILE = os.getenv("USERS_FILE", "users.json")
+DEFAULT_USERS = {
     "admin": {
-        "password_hash": generate_password_hash("plotpointe2025"),
+        "password_hash": "pbkdf2:sha256:600000$qwGHYvUeh6ZJNZ5P$2bd3e44bd1e27376b7c185d2e936a0d82199b4b77f1ce4afab96cabeeb93644e",
         "role": "admin"
     },
     "demo": {
-        "password_hash": generate_password_hash("demouser"),
+        "password_hash": "pbkdf2:sha256:600000$NgRPLBqyzRhs5SYh$1a56ea3f79d635ee20966e6408b8231d4fe0cfe0f2ed0533a811d7f51c096300",
         "role": "user"
     }
 }
+USERS = None
+USERS_MTIME = None
+USERS_LOCK = threading.Lock()
+
+def get_users(reload=False):
+    """Load the user store on first use (and again if another process changed the file)"""
+    global USERS, USERS_MTIME
+    try:
+        mtime = os.path.getmtime(USERS_FILE)
+    except OSError:
+        mtime = None
+    
+    with USERS_LOCK:
+        if USERS is None or reload or mtime != USERS_MTIME:
+            if mtime is None:
+                USERS = {username: dict(info) for username, info in DEFAULT_USERS.items()}
+            else:
+                with open(USERS_FILE) as f:
+                    USERS = json.load(f)
+            USERS_MTIME = mtime
+        return USERS
+
+@contextmanager
+def users_file_lock():
+    """Hold an exclusive lock on the user store across processes (e.g. gunicorn workers)"""
+    with open(f"{USERS_FILE}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def save_users(users):
+    """Persist the user store, replacing the file atomically"""
+    global USERS, USERS_MTIME
+    with USERS_LOCK:
+        tmp_path = f"{USERS_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(users, f, indent=2)
+        os.replace(tmp_path, USERS_FILE)
+        USERS = users
+        USERS_MTIME = os.path.getmtime(USERS_FILE)
+
+def get_claude_client():
+    """Create an Anthropic client (the SDK is imported on first use to keep worker startup fast)"""
+    import anthropic
+    return anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+
+def preload_heavy_imports():
+    """Import the generation and DOCX libraries up front, e.g. in a preloading gunicorn master before forking"""
+    import anthropic
+    import docx
+    import docx2txt
+
+# Admins can profile a single request by adding ?profile=1
+@app.before_request
+def start_request_profile():
+    if "profile" in request.args and session.get("role") == "admin":
+        g.profile = profiling.start_profile()
+
+@app.teardown_request
+def finish_request_profile(exc):
+    handle = g.pop("profile", None)
+    if handle is not None:
+        profiling.finish_profile(handle, "request", f"{request.method} {request.path}")
 
 # Login required decorator
 def login_required(f):
@@ -63,9 +176,10 @@ def login():
         username = request.form.get("username")
         password = request.form.get("password")
         
-        if username in USERS and check_password_hash(USERS[username]["password_hash"], password):
+        users = get_users()
+        if username in users and check_password_hash(users[username]["password_hash"], password):
             session["user"] = username
-            session["role"] = USERS[username]["role"]
+            session["role"] = users[username]["role"]
             return redirect(url_for("dashboard"))
         
         flash("Invalid username or password", "error")
@@ -95,14 +209,12 @@ def inject_year():
 @app.route("/api/rewrite-script", methods=["POST"])
 @login_required
 def api_rewrite_script():
-    # Initialize task ID and save it in the session
-    task_id = str(uuid.uuid4())
-    
     # Check if there's a file upload
     if "script_file" in request.files and request.files["script_file"].filename != "":
         script_file = request.files["script_file"]
         if script_file.filename.endswith(".docx"):
             # Extract text from docx
+            import docx2txt
             script_text = docx2txt.process(script_file)
         else:
             return jsonify({"status": "error", "message": "Invalid file format. Please upload a DOCX file."})
@@ -119,15 +231,14 @@ def api_rewrite_script():
     
     target_char_count = int(target_char_count)
     
-    # Start a background thread to process the script
-    thread = threading.Thread(
-        target=process_script_rewrite,
-        args=(task_id, script_text, target_char_count)
+    # Start a background thread to process the script (or attach to an identical running one)
+    task_id, coalesced = start_background_task(
+        process_script_rewrite,
+        script_text,
+        {"target_char_count": target_char_count}
     )
-    thread.daemon = True
-    thread.start()
     
-    return jsonify({"status": "processing", "task_id": task_id})
+    return jsonify({"status": "processing", "task_id": task_id, "coalesced": coalesced})
 
 def process_script_rewrite(task_id, script_text, target_char_count):
     """Background process to rewrite a script using Claude API"""
@@ -135,7 +246,7 @@ def process_script_rewrite(task_id, script_text, target_char_count):
         # Store initial status
         save_task_status(task_id, "processing", "Starting rewrite process...", 0)
         
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        client = get_claude_client()
         
         # Calculate allowed character count range (±5%)
         min_chars = int(target_char_count * 0.95)
@@ -316,32 +427,188 @@ If trimming: Remove some unnecessary words and phrases without changing any cont
         save_task_status(task_id, "error", f"Error during processing: {str(e)}", 0)
         print(f"Error in script rewrite: {str(e)}")
 
-# In-memory task storage (use a database in production)
-TASKS = {}
+# Task storage: in-memory for the thread backend, shared SQLite when a separate worker runs the jobs
+if GENERATION_BACKEND == "queue":
+    TASKS = job_queue.SqliteTaskStore()
+else:
+    TASKS = {}
+
+# In-flight submissions keyed by owner, tool and normalized input, so duplicates share one task
+INFLIGHT_TASKS = {}
+INFLIGHT_LOCK = threading.Lock()
+COALESCE_STATS = {"coalesced_requests": 0}
+
+# Gzipped task results keyed by (task_id, version), so repeated downloads don't recompress
+RESULT_CACHE = {}
+RESULT_CACHE_SIZE = 64
+RESULT_CACHE_LOCK = threading.Lock()
 
 def save_task_status(task_id, status, message, progress, result=None):
     """Save task status in the global TASKS dictionary"""
+    previous = get_task_status(task_id)
     TASKS[task_id] = {
         "status": status,
         "message": message,
         "progress": progress,
         "result": result,
-        "timestamp": time.time()
+        "timestamp": time.time(),
+        # Bumped on every update; used as the ETag for status polls
+        "version": (previous["version"] + 1) if previous else 1
     }
+    
+    if profiling.ACTIVE_TASKS:
+        profiling.record_step(task_id, message)
+    
+    # Finished tasks no longer accept new submissions
+    if status in ("completed", "error"):
+        with INFLIGHT_LOCK:
+            for key in [k for k, v in INFLIGHT_TASKS.items() if v == task_id]:
+                del INFLIGHT_TASKS[key]
+
+def submission_key(tool, text, params):
+    """Build the single-flight key for a submission from its owner, tool, input and parameters"""
+    normalized_text = re.sub(r'\s+', ' ', text).strip()
+    payload = json.dumps({
+        "owner": session.get("user"),
+        "tool": tool,
+        "text": normalized_text,
+        "params": params
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def start_background_task(target, text, params):
+    """Start target(task_id, text, *params) in the background, or attach to an identical in-flight task.
+    Returns (task_id, coalesced)"""
+    key = submission_key(target.__name__, text, params)
+    
+    if GENERATION_BACKEND == "queue":
+        task_id, coalesced = job_queue.enqueue_job(target.__name__, [text, *params.values()], dedupe_key=key)
+        if "profile" in g and not coalesced:
+            profiling.arm_task(task_id)
+        return task_id, coalesced
+    
+    with INFLIGHT_LOCK:
+        task_id = INFLIGHT_TASKS.get(key)
+        if task_id is not None and task_id in TASKS:
+            COALESCE_STATS["coalesced_requests"] += 1
+            return task_id, True
+        
+        task_id = str(uuid.uuid4())
+        INFLIGHT_TASKS[key] = task_id
+        # Register the task before the thread starts so attached requests can poll it immediately
+        TASKS[task_id] = {
+            "status": "processing",
+            "message": "Starting...",
+            "progress": 0,
+            "result": None,
+            "timestamp": time.time(),
+            "version": 1
+        }
+    
+    try:
+        # A profiled submission request also profiles the task it starts
+        if "profile" in g:
+            profiling.arm_task(task_id)
+        
+        thread = threading.Thread(
+            target=run_background_task,
+            args=(task_id, target, (text, *params.values()))
+        )
+        thread.daemon = True
+        thread.start()
+    except Exception:
+        # Don't leave a placeholder that identical submissions would attach to forever
+        with INFLIGHT_LOCK:
+            if INFLIGHT_TASKS.get(key) == task_id:
+                del INFLIGHT_TASKS[key]
+            TASKS.pop(task_id, None)
+        raise
+    
+    return task_id, False
+
+def run_background_task(task_id, target, args):
+    """Thread target for start_background_task; a failure outside the pipeline's own error handling
+    still marks the task as failed, which also releases its submission key"""
+    try:
+        profiling.run_task(task_id, target, args)
+    except Exception as e:
+        save_task_status(task_id, "error", f"Error during processing: {str(e)}", 0)
+        print(f"Error in background task {task_id}: {str(e)}")
+
+def get_task_status(task_id):
+    """Look up a task without loading its result text (None if not found)"""
+    if GENERATION_BACKEND == "queue":
+        return TASKS.get_status(task_id)
+    return TASKS.get(task_id)
 
 @app.route("/api/task-status/<task_id>")
+@session_readonly
 @login_required
 def api_task_status(task_id):
-    """Get the status of a background task"""
-    if task_id in TASKS:
-        return jsonify(TASKS[task_id])
-    return jsonify({"status": "error", "message": "Task not found"})
+    """Get the status of a background task (progress only; the text is served by /api/task-result)"""
+    # Older clients can still ask for the full result inline
+    include_result = bool(request.args.get("include_result"))
+    task = TASKS.get(task_id) if include_result else get_task_status(task_id)
+    if task is None:
+        return jsonify({"status": "error", "message": "Task not found"})
+    
+    payload = {
+        "status": task["status"],
+        "message": task["message"],
+        "progress": task["progress"],
+        "timestamp": task["timestamp"],
+        "version": task["version"]
+    }
+    if task["status"] == "completed":
+        payload["result_url"] = url_for("api_task_result", task_id=task_id)
+        if include_result:
+            payload["result"] = task["result"]
+    
+    response = make_response(jsonify(payload))
+    response.set_etag(f"{task_id}-{task['version']}{'-full' if 'result' in payload else ''}")
+    # Make browsers revalidate every poll so unchanged statuses come back as 304
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+@app.route("/api/task-result/<task_id>")
+@session_readonly
+@login_required
+def api_task_result(task_id):
+    """Serve the result text of a completed task, gzipped when accepted, with Range support"""
+    task = TASKS.get(task_id)
+    if task is None or task["status"] != "completed":
+        return jsonify({"status": "error", "message": "Task not completed or not found"}), 404
+    
+    body = task["result"].encode("utf-8")
+    # Accept-Encoding qualities matter: "gzip;q=0" means the client refuses gzip
+    use_gzip = request.accept_encodings["gzip"] > 0
+    if use_gzip:
+        cache_key = (task_id, task["version"])
+        with RESULT_CACHE_LOCK:
+            compressed = RESULT_CACHE.get(cache_key)
+        if compressed is None:
+            compressed = gzip.compress(body, compresslevel=6)
+            with RESULT_CACHE_LOCK:
+                if len(RESULT_CACHE) >= RESULT_CACHE_SIZE:
+                    RESULT_CACHE.pop(next(iter(RESULT_CACHE)))
+                RESULT_CACHE[cache_key] = compressed
+        body = compressed
+    
+    response = app.response_class(body, mimetype="text/plain")
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "private, max-age=3600"
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(f"{task_id}-{task['version']}{'-gz' if use_gzip else ''}")
+    # Ranges apply to the bytes actually sent (the gzipped body when compressed)
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
 
 @app.route("/api/download-docx/<task_id>")
 @login_required
 def api_download_docx(task_id):
     """Generate and download a DOCX file from the rewritten script"""
     from flask import send_file
+    from docx import Document
     
     if task_id not in TASKS or TASKS[task_id]["status"] != "completed":
         return jsonify({"status": "error", "message": "Task not completed or not found"})
@@ -379,14 +646,12 @@ def story_writer():
 @app.route("/api/generate-story", methods=["POST"])
 @login_required
 def api_generate_story():
-    # Initialize task ID
-    task_id = str(uuid.uuid4())
-    
     # Check if there's a file upload
     if "plot_file" in request.files and request.files["plot_file"].filename != "":
         plot_file = request.files["plot_file"]
         if plot_file.filename.endswith(".docx"):
             # Extract text from docx
+            import docx2txt
             plot_ideas = docx2txt.process(plot_file)
         else:
             return jsonify({"status": "error", "message": "Invalid file format. Please upload a DOCX file."})
@@ -403,15 +668,14 @@ def api_generate_story():
     
     min_word_count = int(min_word_count)
     
-    # Start a background thread to generate the story
-    thread = threading.Thread(
-        target=process_story_generation,
-        args=(task_id, plot_ideas, min_word_count)
+    # Start a background thread to generate the story (or attach to an identical running one)
+    task_id, coalesced = start_background_task(
+        process_story_generation,
+        plot_ideas,
+        {"min_word_count": min_word_count}
     )
-    thread.daemon = True
-    thread.start()
     
-    return jsonify({"status": "processing", "task_id": task_id})
+    return jsonify({"status": "processing", "task_id": task_id, "coalesced": coalesced})
 
 def process_story_generation(task_id, plot_ideas, min_word_count):
     """Background process to generate a story using Claude API"""
@@ -419,7 +683,7 @@ def process_story_generation(task_id, plot_ideas, min_word_count):
         # Store initial status
         save_task_status(task_id, "processing", "Starting story generation...", 0)
         
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        client = get_claude_client()
         
         # Calculate approximate character count (avg 5 chars per word)
         min_char_count = min_word_count * 5
@@ -567,6 +831,7 @@ Remember that Reddit stories are typically more about recounting events and shar
 def api_download_story(task_id):
     """Generate and download a DOCX file from the generated story"""
     from flask import send_file
+    from docx import Document
     
     if task_id not in TASKS or TASKS[task_id]["status"] != "completed":
         return jsonify({"status": "error", "message": "Task not completed or not found"})
@@ -614,14 +879,12 @@ def plot_generator():
 @app.route("/api/generate-plot", methods=["POST"])
 @login_required
 def api_generate_plot():
-    # Initialize task ID
-    task_id = str(uuid.uuid4())
-    
     # Check if there's a file upload
     if "prompt_file" in request.files and request.files["prompt_file"].filename != "":
         prompt_file = request.files["prompt_file"]
         if prompt_file.filename.endswith(".docx"):
             # Extract text from docx
+            import docx2txt
             plot_prompt = docx2txt.process(prompt_file)
         else:
             return jsonify({"status": "error", "message": "Invalid file format. Please upload a DOCX file."})
@@ -643,15 +906,30 @@ def api_generate_plot():
     paragraph_count = int(paragraph_count)
     progressions_per_paragraph = int(progressions_per_paragraph)
     
-    # Start a background thread to generate the plot
-    thread = threading.Thread(
-        target=process_plot_generation,
-        args=(task_id, plot_prompt, paragraph_count, progressions_per_paragraph)
+    # Large outlines default to the two-phase (skeleton + parallel expansion) mode
+    generation_mode = request.form.get("generation_mode", "").strip()
+    if generation_mode not in ("single", "two_phase"):
+        if paragraph_count * progressions_per_paragraph >= PLOT_TWO_PHASE_THRESHOLD:
+            generation_mode = "two_phase"
+        else:
+            generation_mode = "single"
+    
+    if generation_mode == "two_phase":
+        target = process_plot_generation_two_phase
+    else:
+        target = process_plot_generation
+    
+    # Start a background thread to generate the plot (or attach to an identical running one)
+    task_id, coalesced = start_background_task(
+        target,
+        plot_prompt,
+        {
+            "paragraph_count": paragraph_count,
+            "progressions_per_paragraph": progressions_per_paragraph
+        }
     )
-    thread.daemon = True
-    thread.start()
     
-    return jsonify({"status": "processing", "task_id": task_id})
+    return jsonify({"status": "processing", "task_id": task_id, "coalesced": coalesced})
 
 def process_plot_generation(task_id, plot_prompt, paragraph_count, progressions_per_paragraph):
     """Background process to generate a plot structure using Claude API"""
@@ -659,7 +937,7 @@ def process_plot_generation(task_id, plot_prompt, paragraph_count, progressions_
         # Store initial status
         save_task_status(task_id, "processing", "Starting plot structure generation...", 0)
         
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        client = get_claude_client()
         
         # Craft the prompt to generate a structured plot
         api_prompt = f"""
@@ -728,11 +1006,214 @@ Make the story emotionally engaging, realistic, and maintain the casual Reddit s
         save_task_status(task_id, "error", f"Error during processing: {str(e)}", 0)
         print(f"Error in plot generation: {str(e)}")
 
+def stream_completion(client, prompt):
+    """Run a single streaming Claude call and return the full text"""
+    with client.messages.stream(
+        model="claude-3-7-sonnet-20250219",
+        max_tokens=64000,
+        messages=[
+            {"role": "user", "content": prompt}
+        ]
+    ) as stream:
+        text = ""
+        for chunk in stream:
+            if chunk.type == "content_block_delta" and chunk.delta.type == "text_delta":
+                text += chunk.delta.text
+    return text
+
+def parse_plot_skeleton(skeleton_text):
+    """Parse 'Paragraph X | Title | Beat' lines into an ordered list of acts"""
+    acts = {}
+    for line in skeleton_text.splitlines():
+        match = PLOT_SKELETON_LINE.match(line.strip())
+        if match:
+            number = int(match.group(1))
+            acts.setdefault(number, {
+                "title": match.group(2).strip(),
+                "beat": match.group(3).strip()
+            })
+    return [acts[number] for number in sorted(acts)]
+
+def count_plot_progressions(paragraph_text):
+    """Count the numbered '(Progression #X)' items in a generated paragraph"""
+    return len(PLOT_PROGRESSION_LINE.findall(paragraph_text))
+
+def expand_plot_paragraph(client, plot_prompt, acts, index, progressions_per_paragraph):
+    """Generate the body of one paragraph of a two-phase plot outline"""
+    act = acts[index]
+    outline = "\n".join(
+        f"Paragraph {i + 1}: {a['title']} - {a['beat']}" for i, a in enumerate(acts)
+    )
+
+    if index == 0:
+        instructions = """Write this paragraph as the backstory and setup (Act One) in a few sentences of prose.
+Do NOT include numbered plot progressions in this paragraph."""
+    else:
+        first_number = (index - 1) * progressions_per_paragraph + 1
+        last_number = first_number + progressions_per_paragraph - 1
+        instructions = f"""Write exactly {progressions_per_paragraph} plot progressions for this paragraph, numbered {first_number} to {last_number}.
+- Each progression goes on its own line
+- Each progression should follow this pattern: Event/Action BUT obstacle/complication THEREFORE consequence/reaction
+- Number format should be: "X. (Progression #X) Event BUT obstacle THEREFORE consequence"
+"""
+        if index == len(acts) - 1:
+            instructions += "- These progressions should resolve the story effectively\n"
+
+    prompt = f"""
+I'm building a well-structured plot outline from a rough plot prompt. The overall outline has already been decided:
+
+{outline}
+
+Here's the original plot prompt:
+
+{plot_prompt}
+
+Now write ONLY paragraph {index + 1} ({act['title']}): {act['beat']}
+
+{instructions}
+Follow a casual, Reddit-style conversational tone, avoid last names (first names or nicknames only), use minimal dialogue, and keep the conflict realistic.
+
+Respond with the paragraph content only - no section title, no commentary before or after.
+"""
+    return stream_completion(client, prompt).strip()
+
+def process_plot_generation_two_phase(task_id, plot_prompt, paragraph_count, progressions_per_paragraph):
+    """Background process to generate a plot structure as a skeleton plus parallel per-paragraph expansion"""
+    try:
+        # Store initial status
+        save_task_status(task_id, "processing", "Starting plot structure generation...", 0)
+
+        client = get_claude_client()
+
+        # Step 1: Fix the act titles and one-line beats with a short skeleton call
+        skeleton_prompt = f"""
+I need you to plan a plot outline for the following rough plot prompt. Don't write the outline yet - only its skeleton.
+
+Here's the plot prompt:
+
+{plot_prompt}
+
+Give me exactly {paragraph_count} lines, one per paragraph, in this exact format:
+Paragraph X | Section title | One-line beat describing what happens
+
+- Paragraph 1 should establish the backstory and setup (Act One)
+- The middle paragraphs should develop the story with rising conflict and obstacles
+- Paragraph {paragraph_count} should resolve the story effectively
+- Display themes of family dynamics, injustice, systemic challenges, and personal resilience
+
+Respond with the {paragraph_count} lines only.
+"""
+
+        save_task_status(task_id, "processing", "Step 1/2: Planning plot skeleton...", 5)
+
+        acts = []
+        for attempt in range(PLOT_EXPANSION_RETRIES + 1):
+            acts = parse_plot_skeleton(stream_completion(client, skeleton_prompt))
+            if len(acts) == paragraph_count:
+                break
+        if len(acts) != paragraph_count:
+            raise ValueError(f"Plot skeleton had {len(acts)} paragraphs instead of {paragraph_count}")
+
+        # Step 2: Expand each paragraph concurrently, then check it against the requested counts
+        save_task_status(task_id, "processing", f"Step 2/2: Expanding {paragraph_count} paragraphs...", 15)
+
+        bodies = [None] * paragraph_count
+        pending = list(range(paragraph_count))
+        completed = 0
+
+        with ThreadPoolExecutor(max_workers=PLOT_EXPANSION_WORKERS) as executor:
+            for attempt in range(PLOT_EXPANSION_RETRIES + 1):
+                futures = {
+                    executor.submit(
+                        expand_plot_paragraph, client, plot_prompt, acts, index, progressions_per_paragraph
+                    ): index
+                    for index in pending
+                }
+
+                failed = []
+                for future in as_completed(futures):
+                    index = futures[future]
+                    expected = 0 if index == 0 else progressions_per_paragraph
+
+                    # A failed upstream call only fails its own paragraph; the retry loop regenerates it
+                    try:
+                        body = future.result()
+                    except Exception as e:
+                        print(f"Error expanding plot paragraph {index + 1}: {str(e)}")
+                        failed.append(index)
+                        continue
+
+                    # Keep the closest attempt so far in case retries run out
+                    count = count_plot_progressions(body)
+                    if bodies[index] is None or abs(count - expected) < abs(count_plot_progressions(bodies[index]) - expected):
+                        bodies[index] = body
+
+                    if count == expected:
+                        completed += 1
+                        progress = min(90, 15 + (completed / paragraph_count) * 75)
+                        save_task_status(
+                            task_id,
+                            "processing",
+                            f"Step 2/2: Expanded {completed}/{paragraph_count} paragraphs",
+                            progress
+                        )
+                    else:
+                        failed.append(index)
+
+                if not failed:
+                    break
+
+                # Only regenerate the paragraphs that failed the check
+                pending = sorted(failed)
+                if attempt < PLOT_EXPANSION_RETRIES:
+                    save_task_status(
+                        task_id,
+                        "processing",
+                        f"Step 2/2: Regenerating {len(pending)} paragraph(s) that missed the requested structure...",
+                        min(90, 15 + (completed / paragraph_count) * 75)
+                    )
+
+        missing = [index + 1 for index in range(paragraph_count) if bodies[index] is None]
+        if missing:
+            raise ValueError(f"Could not generate paragraph(s) {', '.join(map(str, missing))}")
+
+        # Assemble the paragraphs in order
+        sections = []
+        for index, act in enumerate(acts):
+            header = f"**Paragraph {index + 1} ({act['title']})**"
+            lines = [line.strip() for line in bodies[index].splitlines() if line.strip()]
+            sections.append(header + "\n\n" + "\n\n".join(lines))
+        generated_plot = "\n\n".join(sections)
+
+        # Report paragraphs that still missed their progression count after the retries
+        missed = [
+            index + 1 for index in range(paragraph_count)
+            if count_plot_progressions(bodies[index]) != (0 if index == 0 else progressions_per_paragraph)
+        ]
+        if missed:
+            message = f"Plot structure generated, but paragraph(s) {', '.join(map(str, missed))} don't have the requested number of progressions."
+        else:
+            message = "Plot structure generation completed successfully!"
+
+        # Complete the task
+        save_task_status(
+            task_id,
+            "completed",
+            message,
+            100,
+            result=generated_plot
+        )
+
+    except Exception as e:
+        save_task_status(task_id, "error", f"Error during processing: {str(e)}", 0)
+        print(f"Error in plot generation: {str(e)}")
+
 @app.route("/api/download-plot/<task_id>")
 @login_required
 def api_download_plot(task_id):
     """Generate and download a DOCX file from the generated plot structure"""
     from flask import send_file
+    from docx import Document
     
     if task_id not in TASKS or TASKS[task_id]["status"] != "completed":
         return jsonify({"status": "error", "message": "Task not completed or not found"})
@@ -771,6 +1252,32 @@ def api_download_plot(task_id):
         download_name=f"generated_plot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
     )
 
+# Pipelines the worker process is allowed to run, by name
+JOB_TARGETS = {
+    target.__name__: target
+    for target in (
+        process_script_rewrite,
+        process_story_generation,
+        process_plot_generation,
+        process_plot_generation_two_phase
+    )
+}
+
+def get_task_counts():
+    """Number of tasks per status"""
+    if GENERATION_BACKEND == "queue":
+        return TASKS.status_counts()
+    counts = {}
+    for task in list(TASKS.values()):
+        counts[task["status"]] = counts.get(task["status"], 0) + 1
+    return counts
+
+def get_coalesced_count():
+    """Number of submissions that were attached to an already running task"""
+    if GENERATION_BACKEND == "queue":
+        return job_queue.get_counter("coalesced_requests")
+    return COALESCE_STATS["coalesced_requests"]
+
 # Admin routes
 @app.route("/admin")
 @login_required
@@ -780,14 +1287,22 @@ def admin():
         return redirect(url_for("dashboard"))
     
     # Collect stats and user info for admin dashboard
+    task_counts = get_task_counts()
     stats = {
-        "total_tasks": len(TASKS),
-        "completed_tasks": sum(1 for task in TASKS.values() if task["status"] == "completed"),
-        "error_tasks": sum(1 for task in TASKS.values() if task["status"] == "error"),
-        "user_count": len(USERS)
+        "total_tasks": sum(task_counts.values()),
+        "completed_tasks": task_counts.get("completed", 0),
+        "error_tasks": task_counts.get("error", 0),
+        "coalesced_requests": get_coalesced_count(),
+        "user_count": len(get_users())
     }
     
-    return render_template("admin.html", stats=stats, users=USERS)
+    return render_template(
+        "admin.html",
+        stats=stats,
+        users=get_users(),
+        profiles=profiling.list_profiles(20),
+        armed_profiles=profiling.armed_targets()
+    )
 
 @app.route("/admin/add-user", methods=["POST"])
 @login_required
@@ -802,26 +1317,82 @@ def admin_add_user():
     if not username or not password:
         return jsonify({"status": "error", "message": "Username and password are required"})
     
-    if username in USERS:
-        return jsonify({"status": "error", "message": "Username already exists"})
+    # Hash outside the lock; PBKDF2 is slow
+    password_hash = generate_password_hash(password)
     
-    # Add user to the database
-    USERS[username] = {
-        "password_hash": generate_password_hash(password),
-        "role": role
-    }
+    # Reload, update and write under the file lock so concurrent adds in other workers aren't lost
+    with users_file_lock():
+        users = dict(get_users(reload=True))
+        if username in users:
+            return jsonify({"status": "error", "message": "Username already exists"})
+        
+        # Add user to the database
+        users[username] = {
+            "password_hash": password_hash,
+            "role": role
+        }
+        save_users(users)
     
     return jsonify({"status": "success", "message": f"User {username} added successfully"})
 
+@app.route("/admin/profiling", methods=["POST"])
+@login_required
+def admin_profiling():
+    if session.get("role") != "admin":
+        return jsonify({"status": "error", "message": "Access denied"})
+    
+    action = request.form.get("action")
+    if action == "arm":
+        task_id = request.form.get("task_id", "").strip()
+        if task_id and not re.fullmatch(r'[0-9a-f-]{36}', task_id):
+            return jsonify({"status": "error", "message": "Invalid task id"})
+        # Markers are only read when a task starts, so only tasks still waiting in the queue can be armed
+        if task_id and (GENERATION_BACKEND != "queue" or job_queue.get_job_status(task_id) != "queued"):
+            return jsonify({
+                "status": "error",
+                "message": "Only tasks still waiting in the queue can be profiled by id. Arm the next task or add ?profile=1 to the submission instead."
+            })
+        profiling.arm_task(task_id or None)
+        target = f"task {task_id}" if task_id else "the next task"
+        return jsonify({"status": "success", "message": f"Profiling armed for {target}"})
+    if action == "disarm":
+        profiling.disarm_all()
+        return jsonify({"status": "success", "message": "Profiling disarmed"})
+    return jsonify({"status": "error", "message": "Unknown action"})
+
+@app.route("/admin/profiles/<profile_id>")
+@login_required
+def admin_download_profile(profile_id):
+    """Download a saved profile: the raw cProfile stats (.prof) or the JSON summary"""
+    from flask import send_file
+    
+    if session.get("role") != "admin":
+        return jsonify({"status": "error", "message": "Access denied"})
+    
+    extension = "json" if request.args.get("format") == "json" else "prof"
+    path = profiling.profile_path(profile_id, extension)
+    if path is None:
+        return jsonify({"status": "error", "message": "Profile not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{profile_id}.{extension}")
+
 # Scheduled task to clean up old tasks (run this in a separate thread in production)
 def cleanup_old_tasks():
     """Remove tasks older than 24 hours to prevent memory issues"""
     now = time.time()
     cutoff = now - (24 * 60 * 60)  # 24 hours ago
     
+    if GENERATION_BACKEND == "queue":
+        job_queue.prune_tasks(cutoff)
+        job_queue.prune_jobs(cutoff)
+        return
+    
     for task_id in list(TASKS.keys()):
         if TASKS[task_id]["timestamp"] < cutoff:
             del TASKS[task_id]
+    
+    with INFLIGHT_LOCK:
+        for key in [k for k, v in INFLIGHT_TASKS.items() if v not in TASKS]:
+            del INFLIGHT_TASKS[key]
 
 # Run the app
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+# assets.py
+# Fingerprinted, precompressed static assets served with long-lived immutable caching.
+# Templates use asset_url('css/style.css'), which resolves to e.g. /assets/css/style.3f2a9c1b7d4e.css
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import abort, current_app, request, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Only text formats benefit from compression
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+class Asset:
+    def __init__(self, data, mimetype, digest):
+        self.data = data
+        self.mimetype = mimetype
+        self.digest = digest
+        self.variants = {}  # content encoding -> compressed bytes
+
+class AssetPipeline:
+    """Builds the fingerprint manifest and compressed variants of the static folder at startup"""
+
+    def __init__(self, app=None):
+        self.manifest = {}  # logical name -> fingerprinted name
+        self.assets = {}  # fingerprinted name -> Asset
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.build(app.static_folder)
+        app.add_url_rule("/assets/<path:filename>", "asset", self.serve)
+        app.context_processor(lambda: {"asset_url": self.url})
+
+    def build(self, static_folder):
+        """Fingerprint every file under static_folder by content hash and precompress text assets"""
+        manifest = {}
+        assets = {}
+        for root, dirs, files in os.walk(static_folder):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                logical = os.path.relpath(path, static_folder).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    data = f.read()
+
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                base, ext = os.path.splitext(logical)
+                fingerprinted = f"{base}.{digest}{ext}"
+                mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+                asset = Asset(data, mimetype, digest)
+                if mimetype.startswith(COMPRESSIBLE_TYPES):
+                    asset.variants["gzip"] = gzip.compress(data, compresslevel=9)
+                    if brotli is not None:
+                        asset.variants["br"] = brotli.compress(data, quality=11)
+                    # Keep a variant only if it's actually smaller
+                    asset.variants = {
+                        encoding: body for encoding, body in asset.variants.items() if len(body) < len(data)
+                    }
+
+                manifest[logical] = fingerprinted
+                assets[fingerprinted] = asset
+        self.manifest = manifest
+        self.assets = assets
+
+    def url(self, filename):
+        """Resolve a static file to its fingerprinted URL (falls back to the plain static URL)"""
+        fingerprinted = self.manifest.get(filename)
+        if fingerprinted is None:
+            return url_for("static", filename=filename)
+        return url_for("asset", filename=fingerprinted)
+
+    def serve(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+
+        # Prefer brotli, then gzip, then the original bytes. Check the quality, since
+        # "br;q=0" means the client refuses brotli.
+        body, encoding = asset.data, None
+        for candidate in ("br", "gzip"):
+            if candidate in asset.variants and request.accept_encodings[candidate] > 0:
+                body, encoding = asset.variants[candidate], candidate
+                break
+
+        response = current_app.response_class(body, mimetype=asset.mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if asset.variants:
+            response.headers["Vary"] = "Accept-Encoding"
+        # The name changes whenever the content does, so browsers never need to revalidate
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        response.set_etag(f"{asset.digest}-{encoding or 'identity'}")
+        return response.make_conditional(request)
@@ -0,0 +1,11 @@
+# gunicorn.conf.py
+import os
+
+# Optional fork-friendly layout: with GUNICORN_PRELOAD=true the app and its heavy
+# generation/DOCX libraries are imported once in the master and shared by forked workers
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.preload_heavy_imports()
@@ -0,0 +1,289 @@
+# job_queue.py
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections.abc import MutableMapping
+
+# SQLite file shared by the web tier and the generation worker. Both processes must
+# see the same file, i.e. run on the same host or share a volume.
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "plotpointe_jobs.db")
+
+# Jobs whose worker hasn't sent a heartbeat for this long are handed to another worker
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 300))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    task_id TEXT PRIMARY KEY,
+    target TEXT NOT NULL,
+    args TEXT NOT NULL,
+    dedupe_key TEXT,
+    status TEXT NOT NULL,
+    worker TEXT,
+    heartbeat REAL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    message TEXT,
+    progress REAL,
+    result TEXT,
+    timestamp REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_initialized = set()
+
+def connect(path=None):
+    """Open a connection to the job database, creating the schema on first use"""
+    path = path or JOBS_DB_PATH
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if path not in _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        # Databases created before task versioning lack the version column
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(tasks)")]
+        if "version" not in columns:
+            conn.execute("ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        _initialized.add(path)
+    return conn
+
+def enqueue_job(target, args, dedupe_key=None):
+    """Queue a job, or return the matching queued/running job. Returns (task_id, coalesced)"""
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if dedupe_key is not None:
+            row = conn.execute(
+                "SELECT task_id FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                (dedupe_key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "INSERT INTO counters (name, value) VALUES ('coalesced_requests', 1) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + 1"
+                )
+                conn.execute("COMMIT")
+                return row["task_id"], True
+
+        task_id = str(uuid.uuid4())
+        now = time.time()
+        conn.execute(
+            "INSERT INTO jobs (task_id, target, args, dedupe_key, status, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+            (task_id, target, json.dumps(args), dedupe_key, now)
+        )
+        conn.execute(
+            "INSERT INTO tasks (task_id, status, message, progress, result, timestamp, version) VALUES (?, 'processing', ?, 0, NULL, ?, 1)",
+            (task_id, "Queued, waiting for a worker...", now)
+        )
+        conn.execute("COMMIT")
+        return task_id, False
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def claim_job(worker_id):
+    """Claim the oldest queued (or abandoned) job for this worker. Returns (task_id, target, args) or None"""
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        row = conn.execute(
+            "SELECT task_id, target, args FROM jobs "
+            "WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) "
+            "ORDER BY created LIMIT 1",
+            (now - JOB_STALE_SECONDS,)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker = ?, heartbeat = ? WHERE task_id = ?",
+            (worker_id, now, row["task_id"])
+        )
+        conn.execute("COMMIT")
+        return row["task_id"], row["target"], json.loads(row["args"])
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def get_job_status(task_id):
+    """Status of a job ('queued', 'running' or 'done'), or None if there is no such job"""
+    conn = connect()
+    try:
+        row = conn.execute("SELECT status FROM jobs WHERE task_id = ?", (task_id,)).fetchone()
+        return row["status"] if row else None
+    finally:
+        conn.close()
+
+def heartbeat_jobs(task_ids):
+    """Mark jobs as still being worked on"""
+    if not task_ids:
+        return
+    conn = connect()
+    try:
+        conn.executemany(
+            "UPDATE jobs SET heartbeat = ? WHERE task_id = ?",
+            [(time.time(), task_id) for task_id in task_ids]
+        )
+    finally:
+        conn.close()
+
+def finish_job(task_id):
+    """Mark a job as done, releasing its dedupe key"""
+    conn = connect()
+    try:
+        conn.execute("UPDATE jobs SET status = 'done' WHERE task_id = ?", (task_id,))
+    finally:
+        conn.close()
+
+def requeue_job(task_id):
+    """Put an unfinished job back on the queue so another worker can pick it up"""
+    conn = connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, heartbeat = NULL WHERE task_id = ? AND status = 'running'",
+            (task_id,)
+        )
+    finally:
+        conn.close()
+
+def get_counter(name):
+    """Read a shared counter"""
+    conn = connect()
+    try:
+        row = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row["value"] if row else 0
+    finally:
+        conn.close()
+
+def prune_tasks(cutoff):
+    """Remove task records (and their results) last updated before cutoff"""
+    conn = connect()
+    try:
+        conn.execute("DELETE FROM tasks WHERE timestamp < ?", (cutoff,))
+    finally:
+        conn.close()
+
+def prune_jobs(cutoff):
+    """Remove finished jobs created before cutoff"""
+    conn = connect()
+    try:
+        conn.execute("DELETE FROM jobs WHERE status = 'done' AND created < ?", (cutoff,))
+    finally:
+        conn.close()
+
+class SqliteTaskStore(MutableMapping):
+    """Dict-like task status store shared between the web tier and the worker"""
+
+    def _row_to_task(self, row):
+        return {
+            "status": row["status"],
+            "message": row["message"],
+            "progress": row["progress"],
+            "result": row["result"],
+            "timestamp": row["timestamp"],
+            "version": row["version"]
+        }
+
+    def __getitem__(self, task_id):
+        conn = connect()
+        try:
+            row = conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise KeyError(task_id)
+        return self._row_to_task(row)
+
+    def get_status(self, task_id):
+        """Like get(), but without reading the (possibly large) result column"""
+        conn = connect()
+        try:
+            row = conn.execute(
+                "SELECT status, message, progress, timestamp, version FROM tasks WHERE task_id = ?",
+                (task_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {
+            "status": row["status"],
+            "message": row["message"],
+            "progress": row["progress"],
+            "result": None,
+            "timestamp": row["timestamp"],
+            "version": row["version"]
+        }
+
+    def __setitem__(self, task_id, task):
+        conn = connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, status, message, progress, result, timestamp, version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task_id, task["status"], task["message"], task["progress"], task["result"], task["timestamp"], task["version"])
+            )
+        finally:
+            conn.close()
+
+    def __delitem__(self, task_id):
+        conn = connect()
+        try:
+            deleted = conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,)).rowcount
+        finally:
+            conn.close()
+        if not deleted:
+            raise KeyError(task_id)
+
+    def __contains__(self, task_id):
+        conn = connect()
+        try:
+            return conn.execute("SELECT 1 FROM tasks WHERE task_id = ?", (task_id,)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def __iter__(self):
+        conn = connect()
+        try:
+            task_ids = [row["task_id"] for row in conn.execute("SELECT task_id FROM tasks")]
+        finally:
+            conn.close()
+        return iter(task_ids)
+
+    def __len__(self):
+        conn = connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        finally:
+            conn.close()
+
+    def status_counts(self):
+        """Number of tasks per status, without reading any task rows"""
+        conn = connect()
+        try:
+            return {row[0]: row[1] for row in conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status")}
+        finally:
+            conn.close()
+
+    def values(self):
+        # One query instead of a lookup per task
+        conn = connect()
+        try:
+            return [self._row_to_task(row) for row in conn.execute("SELECT * FROM tasks")]
+        finally:
+            conn.close()
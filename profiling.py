@@ -0,0 +1,241 @@
+# profiling.py
+# On-demand profiling of individual tasks and requests, armed from /admin.
+# Nothing is profiled unless armed: tasks only check for an arming marker when they start,
+# and requests are only profiled when an admin adds ?profile=1.
+# Only one profile runs at a time per process; a task armed while another profile is
+# active waits briefly (PROFILE_WAIT_SECONDS) and then runs unprofiled.
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+
+# Shared directory, so arming from the web tier also reaches the generation worker.
+# Like the job queue, this only works when both run on the same host (or share a volume).
+PROFILES_DIR = os.getenv("PROFILES_DIR", "profiles")
+ARMED_DIR = os.path.join(PROFILES_DIR, "armed")
+NEXT_TASK_MARKER = "next-task"
+# Arming markers that were never claimed (e.g. the task was never started) expire after this long
+ARMED_MARKER_TTL = int(os.getenv("ARMED_MARKER_TTL", 3600))
+# How long an armed task waits for another profile (e.g. the request that started it) to finish
+PROFILE_WAIT_SECONDS = float(os.getenv("PROFILE_WAIT_SECONDS", 5))
+
+# Buckets for the time breakdown, matched against the profiled function's file or name
+CATEGORIES = {
+    "upstream": ("anthropic", "httpx", "httpcore", "ssl.py", "socket"),
+    "docx": ("docx", "docx2txt", "zipfile"),
+    "regex": ("re/__init__.py", "re.Pattern", "re.Match", "sre_"),
+    "locks": ("_thread.lock", "_thread.RLock", "threading.py")
+}
+
+# task_id -> list of (timestamp, message), for tasks currently being profiled in this process
+ACTIVE_TASKS = {}
+# Since Python 3.12 cProfile is process-wide and a second enabled profiler raises,
+# so only one profile (request or task) runs at a time in each process
+PROFILE_LOCK = threading.Lock()
+TRACEMALLOC_LOCK = threading.Lock()
+TRACEMALLOC_USERS = [0]
+
+def arm_task(task_id=None):
+    """Profile the given task id when it starts, or the next task to start if no id is given"""
+    os.makedirs(ARMED_DIR, exist_ok=True)
+    expire_markers()
+    with open(os.path.join(ARMED_DIR, task_id or NEXT_TASK_MARKER), "w") as f:
+        f.write(str(time.time()))
+
+def disarm_all():
+    """Remove every pending arming marker"""
+    if os.path.isdir(ARMED_DIR):
+        for name in os.listdir(ARMED_DIR):
+            os.remove(os.path.join(ARMED_DIR, name))
+
+def expire_markers():
+    """Remove arming markers older than ARMED_MARKER_TTL"""
+    if not os.path.isdir(ARMED_DIR):
+        return
+    cutoff = time.time() - ARMED_MARKER_TTL
+    for name in os.listdir(ARMED_DIR):
+        path = os.path.join(ARMED_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def armed_targets():
+    """List pending arming markers"""
+    if not os.path.isdir(ARMED_DIR):
+        return []
+    expire_markers()
+    return sorted(os.listdir(ARMED_DIR))
+
+def _claim_marker(name):
+    # Removing the marker is the claim, so only one process profiles the task
+    try:
+        os.remove(os.path.join(ARMED_DIR, name))
+        return True
+    except OSError:
+        return False
+
+def run_task(task_id, target, args):
+    """Run target(task_id, *args), profiling it if it was armed"""
+    if not os.path.isdir(ARMED_DIR) or not (_claim_marker(task_id) or _claim_marker(NEXT_TASK_MARKER)):
+        return target(task_id, *args)
+
+    handle = start_profile(PROFILE_WAIT_SECONDS)
+    if handle is None:
+        print(f"Profiler busy or unavailable, running task {task_id} unprofiled")
+        return target(task_id, *args)
+
+    ACTIVE_TASKS[task_id] = []
+    try:
+        return target(task_id, *args)
+    finally:
+        finish_profile(handle, "task", task_id)
+        del ACTIVE_TASKS[task_id]
+
+def record_step(task_id, message):
+    """Record a pipeline status message for a profiled task (called from save_task_status)"""
+    steps = ACTIVE_TASKS.get(task_id)
+    if steps is not None:
+        steps.append((time.time(), message))
+
+def step_label(message):
+    # "Step 1/3: Creating initial rewrite... (4000 chars)" -> "Step 1/3: Creating initial rewrite"
+    # "Step 2/2: Expanded 1/3 paragraphs" -> "Step 2/2: Expanded paragraphs"
+    label = message.split("...")[0].strip()
+    # Only trailing progress counters are dropped; the rest of the message is kept as is
+    label = re.sub(r'\s*\(\d+ chars\)$', '', label)
+    label = re.sub(r' \d+/\d+ (\w+)$', r' \1', label)
+    return label
+
+def step_key(message):
+    # Messages within a numbered step ("Step 2/2: ...") all belong to that step
+    match = re.match(r'Step \d+/\d+:', message)
+    return match.group(0) if match else step_label(message)
+
+def step_breakdown(steps, end):
+    """Wall-clock seconds spent between consecutive distinct pipeline steps, labelled by each step's first message"""
+    breakdown = []
+    previous_key = None
+    for index, (started, message) in enumerate(steps):
+        key = step_key(message)
+        finished = steps[index + 1][0] if index + 1 < len(steps) else end
+        if breakdown and key == previous_key:
+            breakdown[-1]["seconds"] += finished - started
+        else:
+            breakdown.append({"step": step_label(message), "seconds": finished - started})
+        previous_key = key
+    return breakdown
+
+def category_breakdown(stats):
+    """Cumulative seconds per category, counting only the outermost call in each category"""
+    def category_of(func):
+        filename, _, name = func
+        for category, patterns in CATEGORIES.items():
+            if any(pattern in filename or pattern in name for pattern in patterns):
+                return category
+        return None
+
+    totals = {category: 0.0 for category in CATEGORIES}
+    for func, (_, _, _, cumtime, callers) in stats.stats.items():
+        category = category_of(func)
+        if category and not any(category_of(caller) == category for caller in callers):
+            totals[category] += cumtime
+    return totals
+
+def _start_tracemalloc():
+    with TRACEMALLOC_LOCK:
+        if TRACEMALLOC_USERS[0] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        TRACEMALLOC_USERS[0] += 1
+
+def _stop_tracemalloc(snapshot=True):
+    with TRACEMALLOC_LOCK:
+        snapshot = tracemalloc.take_snapshot() if snapshot else None
+        peak = tracemalloc.get_traced_memory()[1]
+        TRACEMALLOC_USERS[0] -= 1
+        if TRACEMALLOC_USERS[0] == 0:
+            tracemalloc.stop()
+    return snapshot, peak
+
+def start_profile(wait=0):
+    """Start cProfile and tracemalloc; returns a handle for finish_profile, or None if
+    another profile is still active after waiting up to `wait` seconds or the profiler can't start"""
+    if not PROFILE_LOCK.acquire(timeout=wait):
+        return None
+    profiler = cProfile.Profile()
+    _start_tracemalloc()
+    try:
+        started = time.time()
+        profiler.enable()
+    except Exception as e:
+        _stop_tracemalloc(snapshot=False)
+        PROFILE_LOCK.release()
+        print(f"Error starting profiler: {str(e)}")
+        return None
+    return profiler, started
+
+def finish_profile(handle, kind, target_name):
+    """Stop a profile started with start_profile and save it"""
+    profiler, started = handle
+    try:
+        profiler.disable()
+        finished = time.time()
+        snapshot, peak = _stop_tracemalloc()
+    finally:
+        PROFILE_LOCK.release()
+    profile_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{kind}_{uuid.uuid4().hex[:8]}"
+    try:
+        save_profile(profile_id, kind, target_name, profiler, started, finished, snapshot, peak)
+    except Exception as e:
+        print(f"Error saving profile {profile_id}: {str(e)}")
+
+def save_profile(profile_id, kind, target_name, profiler, started, finished, snapshot, peak):
+    """Write the raw .prof file and a JSON summary to PROFILES_DIR"""
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    # Raw cProfile stats, loadable with pstats or snakeviz
+    prof_path = os.path.join(PROFILES_DIR, f"{profile_id}.prof")
+    profiler.dump_stats(prof_path)
+
+    report = io.StringIO()
+    stats = pstats.Stats(prof_path, stream=report)
+    stats.sort_stats("cumulative").print_stats(40)
+
+    summary = {
+        "id": profile_id,
+        "kind": kind,
+        "target": target_name,
+        "started": started,
+        "seconds": finished - started,
+        "categories": category_breakdown(stats),
+        "steps": step_breakdown(ACTIVE_TASKS.get(target_name, []), finished) if kind == "task" else [],
+        "peak_memory_bytes": peak,
+        "top_allocations": [str(stat) for stat in snapshot.statistics("lineno")[:15]],
+        "report": report.getvalue()
+    }
+    with open(os.path.join(PROFILES_DIR, f"{profile_id}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+def list_profiles(limit=None):
+    """Summaries of saved profiles, newest first (ids start with a timestamp, so names sort by age)"""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    names = sorted((name for name in os.listdir(PROFILES_DIR) if name.endswith(".json")), reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        with open(os.path.join(PROFILES_DIR, name)) as f:
+            profiles.append(json.load(f))
+    return profiles
+
+def profile_path(profile_id, extension):
+    """Path of a saved profile file, or None if it doesn't exist"""
+    if os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(PROFILES_DIR, f"{profile_id}.{extension}")
+    return path if os.path.isfile(path) else None
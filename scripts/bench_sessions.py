@@ -0,0 +1,55 @@
+# scripts/bench_sessions.py
+# Measure per-request session overhead for each session backend.
+# Usage: python scripts/bench_sessions.py [requests]
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter per backend, since the backend is chosen when app.py is imported
+BENCH_CODE = """
+import sys, time
+import app
+
+requests = int(sys.argv[1])
+client = app.app.test_client()
+client.post("/login", data={"username": "demo", "password": "demouser"})
+app.save_task_status("bench", "processing", "Benchmarking...", 50)
+
+def run(path):
+    client.get(path)  # warm up
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - start) / requests * 1e6
+
+# /api/task-status is read-only; /dashboard loads and may save the session
+print(f"{run('/api/task-status/bench'):10.1f} us  {run('/dashboard'):10.1f} us")
+"""
+
+def main():
+    requests = sys.argv[1] if len(sys.argv) > 1 else "2000"
+    print(f"{'backend':<12} {'task-status':>13} {'dashboard':>13}   ({requests} requests each)")
+    for backend in ("filesystem", "sqlite"):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(
+                os.environ,
+                SESSION_BACKEND=backend,
+                SESSION_DB_PATH=os.path.join(workdir, "sessions.db"),
+                PYTHONPATH=ROOT
+            )
+            # Run from a scratch directory so flask_session's files don't land in the repo
+            output = subprocess.run(
+                [sys.executable, "-c", BENCH_CODE, requests],
+                cwd=workdir,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True
+            ).stdout.strip().splitlines()[-1]
+        print(f"{backend:<12} {output}")
+
+if __name__ == "__main__":
+    main()
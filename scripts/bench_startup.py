@@ -0,0 +1,49 @@
+# scripts/bench_startup.py
+# Measure cold-start latency: importing app.py, the first login, and the deferred heavy imports.
+# Usage: python scripts/bench_startup.py [runs]
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter each time so nothing is already imported
+BENCH_CODE = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.post("/login", data={"username": "demo", "password": "demouser"})
+logged_in = time.perf_counter()
+app.preload_heavy_imports()
+preloaded = time.perf_counter()
+print(imported - start, logged_in - imported, preloaded - logged_in)
+"""
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    samples = []
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=ROOT, USERS_FILE=os.path.join(workdir, "users.json"))
+        for _ in range(runs):
+            # Run from a scratch directory so flask_session's files don't land in the repo
+            output = subprocess.run(
+                [sys.executable, "-c", BENCH_CODE],
+                cwd=workdir,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True
+            ).stdout.strip().splitlines()[-1]
+            samples.append([float(value) for value in output.split()])
+
+    print(f"Startup timings over {runs} runs (median / min, ms)")
+    for index, label in enumerate(["import app", "first login", "heavy imports (first generation)"]):
+        values = [sample[index] * 1000 for sample in samples]
+        print(f"  {label:<34} {statistics.median(values):8.1f} / {min(values):8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# sessions.py
+# Server-side sessions kept in an in-memory cache backed by SQLite, so most
+# requests (including the status polls from every open tab) only do a cheap
+# version lookup instead of reading and unpickling a session file.
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from flask import request
+from flask_session.sessions import FileSystemSessionInterface, ServerSideSession, SessionInterface
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    sid TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+"""
+
+class SqliteSession(ServerSideSession):
+    pass
+
+def session_readonly(f):
+    """Mark a view as never changing the session, so it is not saved (or refreshed) after the request"""
+    f.session_readonly = True
+    return f
+
+def is_readonly_request(app):
+    """Whether the current request's view is marked @session_readonly"""
+    view = app.view_functions.get(request.endpoint)
+    return getattr(view, "session_readonly", False)
+
+class ReadOnlyFileSystemSessionInterface(FileSystemSessionInterface):
+    """flask_session's filesystem sessions, except @session_readonly views never rewrite the session file"""
+
+    def save_session(self, app, session, response):
+        if is_readonly_request(app):
+            return
+        super().save_session(app, session, response)
+
+class SqliteSessionInterface(SessionInterface):
+    """Session interface with an in-memory cache in front of a SQLite table and background expiry.
+
+    Every write bumps the row's version. A cached copy is only used after a cheap
+    version check, and writes only succeed if the row still has the version that was
+    loaded, so a stale copy in one gunicorn worker can't resurrect a logged-out
+    session or overwrite newer data written by another worker.
+    """
+
+    session_class = SqliteSession
+
+    def __init__(self, path, permanent=True, cache_size=1000, purge_interval=600):
+        self.path = path
+        self.permanent = permanent
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self.cache = {}  # sid -> (data, expires, version)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.purge_thread = None
+
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # Databases created before versioned sessions lack the version column
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(sessions)")]
+            if "version" not in columns:
+                conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # One connection per thread (and per forked process), reused across requests
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def _start_purge_thread(self):
+        # Started lazily so it runs in each forked gunicorn worker, not just the master
+        if self.purge_thread is None or not self.purge_thread.is_alive():
+            self.purge_thread = threading.Thread(target=self._purge_loop)
+            self.purge_thread.daemon = True
+            self.purge_thread.start()
+
+    def _purge_loop(self):
+        while True:
+            time.sleep(self.purge_interval)
+            try:
+                self.purge_expired()
+            except Exception as e:
+                print(f"Error purging sessions: {str(e)}")
+
+    def purge_expired(self):
+        """Delete expired sessions from the cache and the database"""
+        now = time.time()
+        with self.lock:
+            for sid in [sid for sid, entry in self.cache.items() if entry[1] < now]:
+                del self.cache[sid]
+        self._connect().execute("DELETE FROM sessions WHERE expires < ?", (now,))
+
+    def _load(self, sid):
+        """Return (data, expires, version) for a live session, or (None, None, None)"""
+        conn = self._connect()
+        row = conn.execute("SELECT expires, version FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None or row[0] < time.time():
+            with self.lock:
+                self.cache.pop(sid, None)
+            return None, None, None
+        expires, version = row
+
+        with self.lock:
+            entry = self.cache.get(sid)
+        if entry is not None and entry[2] == version:
+            return entry[0], expires, version
+
+        row = conn.execute("SELECT data, expires, version FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        if row is None:
+            return None, None, None
+        data, expires, version = pickle.loads(row[0]), row[1], row[2]
+        self._cache_put(sid, data, expires, version)
+        return data, expires, version
+
+    def _cache_put(self, sid, data, expires, version):
+        with self.lock:
+            self.cache.pop(sid, None)
+            if len(self.cache) >= self.cache_size:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[sid] = (data, expires, version)
+
+    def _store(self, sid, data, expires, version):
+        """Write a session; version is the one it was loaded with (None for a new session).
+        Returns False if another request changed or deleted the session in the meantime."""
+        conn = self._connect()
+        if version is None:
+            new_version = 1
+            written = conn.execute(
+                "INSERT OR IGNORE INTO sessions (sid, data, expires, version) VALUES (?, ?, ?, ?)",
+                (sid, pickle.dumps(data), expires, new_version)
+            ).rowcount
+        else:
+            new_version = version + 1
+            written = conn.execute(
+                "UPDATE sessions SET data = ?, expires = ?, version = ? WHERE sid = ? AND version = ?",
+                (pickle.dumps(data), expires, new_version, sid, version)
+            ).rowcount
+        if not written:
+            with self.lock:
+                self.cache.pop(sid, None)
+            return False
+        self._cache_put(sid, data, expires, new_version)
+        return True
+
+    def _delete(self, sid):
+        self._connect().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+        with self.lock:
+            self.cache.pop(sid, None)
+
+    def open_session(self, app, request):
+        self._start_purge_thread()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data, expires, version = self._load(sid)
+            if data is not None:
+                session = self.session_class(data, sid=sid)
+                session.expires = expires
+                session.version = version
+                return session
+        session = self.session_class(sid=self._generate_sid(), permanent=self.permanent)
+        session.expires = None
+        session.version = None
+        return session
+
+    def save_session(self, app, session, response):
+        if is_readonly_request(app):
+            return
+
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        name = self.get_cookie_name(app)
+
+        if not session:
+            if session.modified:
+                self._delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        # Only rewrite an unchanged permanent session once half its lifetime has passed.
+        # New sessions that were never written to (anonymous visitors) are not stored at all.
+        needs_refresh = (
+            session.permanent
+            and session.expires is not None
+            and self.should_set_cookie(app, session)
+            and session.expires - now < lifetime / 2
+        )
+        if not session.modified and not needs_refresh:
+            return
+
+        expires = now + lifetime
+        if not self._store(session.sid, dict(session), expires, session.version):
+            # Changed or logged out by a concurrent request; that write wins
+            return
+        session.expires = expires
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
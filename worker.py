@@ -0,0 +1,108 @@
+# worker.py
+# Generation worker: pulls jobs from the SQLite queue and runs the process_* pipelines
+# outside the gunicorn web workers. Run with: python -m worker
+#
+# The queue is a local SQLite file (JOBS_DB_PATH), so the worker must run on the same
+# host as the web processes (or share a volume with them), and the web processes must
+# be started with GENERATION_BACKEND=queue. Separate Heroku dynos don't share a
+# filesystem, which is why the Procfile keeps the default in-process thread backend.
+import os
+
+# The worker always reads jobs from (and reports progress to) the shared queue
+os.environ.setdefault("GENERATION_BACKEND", "queue")
+
+import signal
+import socket
+import threading
+import time
+
+import app
+import job_queue
+import profiling
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 4))
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", 1))
+# Process managers usually send SIGKILL some time after SIGTERM, so finish draining before that
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", 25))
+# How often the worker prunes old task records and finished jobs from the database
+TASK_CLEANUP_INTERVAL = float(os.getenv("TASK_CLEANUP_INTERVAL", 600))
+
+stop_event = threading.Event()
+
+def run_job(task_id, target_name, args):
+    """Run one queued job and mark it done"""
+    try:
+        target = app.JOB_TARGETS.get(target_name)
+        if target is None:
+            app.save_task_status(task_id, "error", f"Unknown job type: {target_name}", 0)
+        else:
+            profiling.run_task(task_id, target, args)
+    except Exception as e:
+        app.save_task_status(task_id, "error", f"Error during processing: {str(e)}", 0)
+        print(f"Error in worker job {task_id}: {str(e)}")
+    finally:
+        job_queue.finish_job(task_id)
+
+def handle_shutdown(signum, frame):
+    """Stop claiming new jobs and start draining"""
+    print(f"Worker received signal {signum}, draining...")
+    stop_event.set()
+
+def main():
+    if app.GENERATION_BACKEND != "queue":
+        raise SystemExit("The worker requires GENERATION_BACKEND=queue")
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    running = {}  # task_id -> thread
+
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    signal.signal(signal.SIGINT, handle_shutdown)
+
+    print(f"Worker {worker_id} started (concurrency {WORKER_CONCURRENCY})")
+
+    last_cleanup = 0
+    while not stop_event.is_set():
+        # Forget finished jobs and keep the claim on the ones still running
+        for task_id in [t for t, thread in running.items() if not thread.is_alive()]:
+            del running[task_id]
+        job_queue.heartbeat_jobs(list(running))
+
+        # Old task records hold full result texts, so prune them regularly
+        if time.time() - last_cleanup >= TASK_CLEANUP_INTERVAL:
+            try:
+                app.cleanup_old_tasks()
+            except Exception as e:
+                print(f"Error cleaning up old tasks: {str(e)}")
+            last_cleanup = time.time()
+
+        if len(running) < WORKER_CONCURRENCY:
+            job = job_queue.claim_job(worker_id)
+            if job is not None:
+                task_id, target_name, args = job
+                thread = threading.Thread(target=run_job, args=(task_id, target_name, args))
+                thread.daemon = True
+                thread.start()
+                running[task_id] = thread
+                continue
+
+        stop_event.wait(WORKER_POLL_INTERVAL)
+
+    # Drain: give running jobs a chance to finish, then hand the rest back to the queue
+    deadline = time.time() + WORKER_DRAIN_TIMEOUT
+    while time.time() < deadline:
+        for task_id in [t for t, thread in running.items() if not thread.is_alive()]:
+            del running[task_id]
+        if not running:
+            break
+        job_queue.heartbeat_jobs(list(running))
+        time.sleep(min(WORKER_POLL_INTERVAL, max(0, deadline - time.time())))
+
+    requeued = [task_id for task_id, thread in running.items() if thread.is_alive()]
+    for task_id in requeued:
+        job_queue.requeue_job(task_id)
+        app.save_task_status(task_id, "processing", "Worker restarted, job re-queued...", 0)
+
+    print(f"Worker {worker_id} stopped ({len(requeued)} job(s) re-queued)")
+
+if __name__ == "__main__":
+    main()